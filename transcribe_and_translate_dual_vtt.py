@@ -5,31 +5,56 @@ Transcreve um vídeo e gera duas VTTs:
  - <prefix>.en.vtt        -> tradução para inglês por segmento
 
 Também pode salvar <prefix>.json com os segments (start,end,lang,text,translation).
+As traduções ficam em cache em <prefix>.trans_cache.json para acelerar novas execuções.
 
 Uso:
   python3 transcribe_and_translate_dual_vtt.py video.mp4 out_prefix --model small --refine-per-segment --no-translate
+  python3 transcribe_and_translate_dual_vtt.py --serve --model small < lista_de_videos.txt
 
 Opções relevantes:
   --model                Whisper model (tiny, base, small, medium, large)
-  --refine-per-segment   Re-transcreve segmentos forçando idioma detectado (melhora acurácia para áudio misto)
+  --refine-per-segment   Re-transcreve, forçando o idioma detectado, só os segmentos (pt/es) cujo idioma difere
+                         do idioma global do vídeo (melhora acurácia para áudio misto; sem efeito em vídeos
+                         de um idioma só, que já são transcritos com esse idioma forçado)
   --no-translate         NÃO gera o arquivo de tradução em inglês (por padrão gera)
   --keep-audio           mantém o arquivo de áudio extraído no diretório atual
+  --compute-type         quantização do CTranslate2 (auto: int8_float16 na GPU, int8 na CPU)
+  --no-vad               não usa o VAD (Silero) para pular segmentos sem fala no refinamento/tradução
+  --batch-size           quantos segmentos enviar por lote à GPU no refinamento/tradução
+  --serve                mantém o modelo carregado e processa "video [out_prefix]" lidos da entrada padrão
   --verbose
 """
 
 import argparse
+import contextlib
 import os
+import sys
+import shlex
+import shutil
 import subprocess
 import tempfile
-import json
-from math import floor
+import wave
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from math import ceil
 from tqdm import tqdm
 
-import whisper
-from langdetect import detect, DetectorFactory, LangDetectException
+import numpy as np
+import orjson
+import ctranslate2
+from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from lingua import LanguageDetectorBuilder
 
-# Determinismo para langdetect
-DetectorFactory.seed = 0
+# Detector de idioma (lingua, em Rust): os modelos são carregados sob demanda.
+# Modo de baixa precisão: só trigramas (dezenas de MB em vez de ~1 GB); em textos muito curtos
+# pode não ter certeza, e aí o segmento fica com o idioma global detectado pelo whisper.
+LANG_DETECTOR = LanguageDetectorBuilder.from_all_languages().with_low_accuracy_mode().build()
+
+# Taxa de amostragem do áudio extraído (whisper espera 16 kHz mono)
+SAMPLE_RATE = 16000
 
 def extract_audio(video_path, out_audio_path):
     """Extrai áudio em WAV mono 16k usando ffmpeg"""
@@ -40,266 +65,508 @@ def extract_audio(video_path, out_audio_path):
     ]
     subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-def extract_audio_segment(input_audio, out_segment, start, end):
-    """Corta intervalo do áudio (start, end em segundos) para um arquivo WAV"""
-    cmd = [
-        "ffmpeg", "-y", "-i", input_audio,
-        "-ss", str(start), "-to", str(end),
-        "-acodec", "pcm_s16le", "-ac", "1", "-ar", "16000",
-        out_segment
-    ]
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def pcm16_to_float(buf):
+    """Converte bytes PCM s16le em float32 no intervalo [-1, 1] (formato esperado pelo whisper)"""
+    return np.frombuffer(buf, dtype=np.int16).astype(np.float32) / 32768.0
 
-def seconds_to_vtt_timestamp(seconds):
-    """Converte segundos float para HH:MM:SS.mmm (VTT)"""
-    ms = int(round((seconds - floor(seconds)) * 1000))
-    total_seconds = int(floor(seconds))
-    s = total_seconds % 60
-    m = (total_seconds // 60) % 60
-    h = (total_seconds // 3600)
-    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
-
-def detect_lang_of_text(text):
-    """Tenta detectar pt/es; fallback '' se incerto"""
-    try:
-        lang = detect(text)
-    except LangDetectException:
-        return ""
-    if lang.startswith("pt"):
-        return "pt"
-    if lang.startswith("es"):
-        return "es"
-    return lang  # pode retornar 'en' etc.
-
-def write_vtt_original(segments, path):
-    """Gera VTT com o texto original (marcando idioma entre colchetes)"""
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("WEBVTT\n\n")
-        for i, s in enumerate(segments, start=1):
-            f.write(f"{i}\n")
-            f.write(f"{seconds_to_vtt_timestamp(s['start'])} --> {seconds_to_vtt_timestamp(s['end'])}\n")
-            lang_tag = s.get("lang","")
-            text = s.get("text","").strip()
-            if lang_tag:
-                f.write(f"[{lang_tag}] {text}\n\n")
-            else:
-                f.write(f"{text}\n\n")
+def load_pcm(audio_path):
+    """Lê o WAV PCM 16-bit gerado por extract_audio direto para float32 em [-1, 1]"""
+    with wave.open(audio_path, "rb") as w:
+        frames = w.readframes(w.getnframes())
+    return pcm16_to_float(frames)
 
-def write_vtt_translation(segments, path):
-    """Gera VTT com a tradução para inglês (cada cue contém apenas o texto em inglês quando disponível).
-       Se não houver tradução, usa texto original como fallback.
-    """
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("WEBVTT\n\n")
-        for i, s in enumerate(segments, start=1):
-            f.write(f"{i}\n")
-            f.write(f"{seconds_to_vtt_timestamp(s['start'])} --> {seconds_to_vtt_timestamp(s['end'])}\n")
-            trans = s.get("translation")
-            if trans and trans.strip():
-                f.write(f"{trans.strip()}\n\n")
-            else:
-                # fallback: original text if no translation
-                f.write(f"{s.get('text','').strip()}\n\n")
-
-def seconds_to_srt_timestamp(seconds):
-    """Converte segundos float para HH:MM:SS,mmm (SRT)"""
-    ms = int(round((seconds - floor(seconds)) * 1000))
-    total_seconds = int(floor(seconds))
-    s = total_seconds % 60
-    m = (total_seconds // 60) % 60
-    h = (total_seconds // 3600)
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
-
-def write_srt_original(segments, path):
-    """Gera SRT com o texto original (marcando idioma entre colchetes)"""
-    with open(path, "w", encoding="utf-8") as f:
-        for i, s in enumerate(segments, start=1):
-            f.write(f"{i}\n")
-            f.write(f"{seconds_to_srt_timestamp(s['start'])} --> {seconds_to_srt_timestamp(s['end'])}\n")
-            lang_tag = s.get("lang","")
-            text = s.get("text","").strip()
-            if lang_tag:
-                f.write(f"[{lang_tag}] {text}\n\n")
-            else:
-                f.write(f"{text}\n\n")
+def read_audio_pcm(video_path):
+    """Decodifica o áudio do vídeo (mono 16k) via pipe do ffmpeg, sem WAV intermediário em disco"""
+    cmd = [
+        "ffmpeg", "-i", video_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-"
+    ]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=1 << 20) as proc:
+        buf = proc.stdout.read()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return pcm16_to_float(buf)
+
+def extract_and_load_audio(video_path, out_audio_path):
+    """Extrai o WAV para out_audio_path (usado com --keep-audio) e o carrega em memória"""
+    extract_audio(video_path, out_audio_path)
+    return load_pcm(out_audio_path)
+
+def format_timestamps(seconds, sep="."):
+    """Converte uma lista de segundos float para HH:MM:SS<sep>mmm de uma vez (numpy)"""
+    arr = np.asarray(seconds, dtype=np.float64)
+    whole = np.floor(arr)
+    ms = np.round((arr - whole) * 1000).astype(np.int64)
+    h, rem = np.divmod(whole.astype(np.int64), 3600)
+    m, s = np.divmod(rem, 60)
+    return [f"{a:02d}:{b:02d}:{c:02d}{sep}{d:03d}"
+            for a, b, c, d in zip(h.tolist(), m.tolist(), s.tolist(), ms.tolist())]
+
+def detect_langs_of_texts(texts):
+    """Detecta o idioma (código ISO 639-1: pt, es, en...) de vários textos numa chamada só;
+       '' para textos vazios ou quando o detector não tem certeza"""
+    langs = [""] * len(texts)
+    idx = [i for i, t in enumerate(texts) if t]
+    results = LANG_DETECTOR.detect_languages_in_parallel_of([texts[i] for i in idx])
+    for i, lang in zip(idx, results):
+        if lang is not None:
+            langs[i] = lang.iso_code_639_1.name.lower()
+    return langs
+
+def cue_text(s, translation=False):
+    """Texto de um cue: original com a tag de idioma, ou a tradução (fallback: texto original)"""
+    if translation:
+        trans = s.get("translation")
+        if trans and trans.strip():
+            return trans.strip()
+        # fallback: original text if no translation
+        return s.get('text','').strip()
+    lang_tag = s.get("lang","")
+    text = s.get("text","").strip()
+    if lang_tag:
+        return f"[{lang_tag}] {text}"
+    return text
 
-def write_srt_translation(segments, path):
-    """Gera SRT com a tradução para inglês.
-       Se não houver tradução, usa texto original como fallback.
+def write_outputs(segments, out_prefix, translation=True):
+    """Gera numa única passada pelos segmentos:
+       <prefix>.original.vtt/.srt (texto original, marcando idioma entre colchetes),
+       <prefix>.en.vtt/.srt (tradução, só se translation=True) e <prefix>.json.
+       Segmentos com translation == "" (sem fala segundo o VAD) ficam fora das faixas em inglês.
+       Os timestamps são formatados uma vez (VTT e SRT só diferem no separador dos ms)
+       e o JSON é montado segmento a segmento. Retorna os caminhos gerados.
     """
-    with open(path, "w", encoding="utf-8") as f:
-        for i, s in enumerate(segments, start=1):
-            f.write(f"{i}\n")
-            f.write(f"{seconds_to_srt_timestamp(s['start'])} --> {seconds_to_srt_timestamp(s['end'])}\n")
-            trans = s.get("translation")
-            if trans and trans.strip():
-                f.write(f"{trans.strip()}\n\n")
-            else:
-                # fallback: original text if no translation
-                f.write(f"{s.get('text','').strip()}\n\n")
-
-def transcribe_full_audio(model, audio_path, verbose=False):
+    outputs = {"original.vtt": ["WEBVTT\n\n"], "original.srt": []}
+    if translation:
+        outputs["en.vtt"] = ["WEBVTT\n\n"]
+        outputs["en.srt"] = []
+    json_parts = []
+    n_en = 0
+    starts = format_timestamps([s["start"] for s in segments], ".")
+    ends = format_timestamps([s["end"] for s in segments], ".")
+    for i, s in enumerate(segments, start=1):
+        ts_vtt = f"{starts[i-1]} --> {ends[i-1]}"
+        ts_srt = ts_vtt.replace(".", ",")
+        text = cue_text(s)
+        outputs["original.vtt"].append(f"{i}\n{ts_vtt}\n{text}\n\n")
+        outputs["original.srt"].append(f"{i}\n{ts_srt}\n{text}\n\n")
+        if translation and s.get("translation") != "":
+            n_en += 1
+            text = cue_text(s, translation=True)
+            outputs["en.vtt"].append(f"{n_en}\n{ts_vtt}\n{text}\n\n")
+            outputs["en.srt"].append(f"{n_en}\n{ts_srt}\n{text}\n\n")
+        # mesmo layout de orjson.dumps(segments, OPT_INDENT_2): cada objeto indentado em 2
+        json_parts.append(orjson.dumps(s, option=orjson.OPT_INDENT_2).replace(b"\n", b"\n  "))
+
+    paths = []
+    for suffix, parts in outputs.items():
+        path = f"{out_prefix}.{suffix}"
+        with open(path, "w", encoding="utf-8", buffering=1 << 20) as f:
+            f.write("".join(parts))
+        paths.append(path)
+    json_out = f"{out_prefix}.json"
+    with open(json_out, "wb", buffering=1 << 20) as jf:
+        if json_parts:
+            jf.write(b"[\n  " + b",\n  ".join(json_parts) + b"\n]")
+        else:
+            jf.write(b"[]")
+    paths.append(json_out)
+    return paths
+
+def resolve_device(compute_type="auto"):
+    """Escolhe device (GPU se houver) e o compute_type efetivo (auto -> int8 quantizado)"""
+    device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    if compute_type == "auto":
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+    return device, compute_type
+
+def load_model(model_name, compute_type="auto"):
+    """Carrega o whisper (CTranslate2) na GPU se houver, com pesos quantizados em int8"""
+    device, compute_type = resolve_device(compute_type)
+    return WhisperModel(model_name, device=device, compute_type=compute_type)
+
+def transcribe_full_audio(model, audio, verbose=False):
     """Transcreve o áudio completo com whisper (detecção automática de idioma e segments)."""
     if verbose:
         print("Transcrevendo áudio completo (detecção automática de idioma)...")
-    res = model.transcribe(audio_path)  # autodetect language
-    segments = res.get("segments", [])
-    overall_lang = res.get("language")
+    segs, info = model.transcribe(audio)  # autodetect language
+    segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segs]
+    overall_lang = info.language
     return segments, overall_lang
 
-def transcribe_segment_audio(model, seg_audio_path, language=None, task=None, verbose=False):
+def speech_ratios(audio, segments):
+    """Fração de cada segmento coberta por fala segundo o VAD (Silero) do faster-whisper"""
+    sr = SAMPLE_RATE
+    speech = get_speech_timestamps(audio, VadOptions())
+    sp_start = np.array([sp["start"] for sp in speech], dtype=np.int64)
+    sp_end = np.array([sp["end"] for sp in speech], dtype=np.int64)
+    ratios = []
+    for seg in segments:
+        a, b = int(seg["start"] * sr), int(seg["end"] * sr)
+        overlap = np.clip(np.minimum(sp_end, b) - np.maximum(sp_start, a), 0, None).sum()
+        ratios.append(overlap / max(b - a, 1))
+    return ratios
+
+def clip_features(model, audio, clips):
+    """Calcula o mel (CPU) de um lote de trechos (start, end, ...), já no formato do encoder"""
+    sr = SAMPLE_RATE
+    return np.stack([
+        pad_or_trim(model.feature_extractor(audio[int(c[0] * sr):int(c[1] * sr)])[..., :-1])
+        for c in clips
+    ])
+
+def decode_clips(model, encoder_output, languages, task="transcribe", beam_size=5):
+    """Decodifica saídas do encoder já calculadas (uma por trecho) com a tarefa pedida"""
+    tokenizers = [
+        Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task=task, language=lang)
+        for lang in languages
+    ]
+    prompts = [model.get_prompt(tok, previous_tokens=[], without_timestamps=True) for tok in tokenizers]
+    results = model.model.generate(
+        encoder_output,
+        prompts,
+        beam_size=beam_size,
+        max_length=model.max_length,
+        suppress_blank=True,
+        suppress_tokens=[-1],
+    )
+    return [tok.decode(r.sequences_ids[0]).strip() for tok, r in zip(tokenizers, results)]
+
+def transcribe_clips(model, audio, clips, tasks=("transcribe",), batch_size=16, verbose=False):
     """
-    Transcreve/Tradução de um segmento de áudio:
-     - language: 'pt' ou 'es' para forçar, ou None
-     - task: None -> transcribe, "translate" -> translate to english
+    Transcreve/Traduz vários trechos do áudio em lote:
+     - clips: lista de (start, end, language) em segundos; language força o idioma da
+       transcrição ('' ou código não suportado -> idioma detectado pelo whisper)
+     - tasks: "transcribe" e/ou "translate"; o encoder roda uma vez por trecho e cada
+       tarefa só decodifica a mesma saída com outros tokens de tarefa
+    O mel é calculado na CPU um lote à frente, em paralelo com o encoder/decoder.
+    Os trechos são agrupados por faixas de duração de 5 s, para que cada lote decodifique
+    textos de tamanho parecido (o lote só termina quando o trecho mais longo termina).
+    A tradução usa sempre o idioma detectado pelo whisper, como antes.
+    Retorna {task: lista de textos na mesma ordem de clips}.
     """
-    options = {}
-    if language:
-        options["language"] = language
-    if task:
-        options["task"] = task
-    if verbose:
-        print(f"-> whisper.transcribe(segment, language={language}, task={task})")
-    res = model.transcribe(seg_audio_path, **options)
-    # Quando task="translate", a resposta tem segmentos com text em inglês.
-    text = ""
-    segs = res.get("segments", [])
-    if segs:
-        text = " ".join([s.get("text","").strip() for s in segs]).strip()
-    else:
-        # fallback: use top-level 'text' if present
-        text = res.get("text","").strip()
-    return text
-
-def main():
-    parser = argparse.ArgumentParser(description="Transcribe video and produce original and English VTTs.")
-    parser.add_argument("video", help="Input video file (mp4, mkv, etc.)")
-    parser.add_argument("out_prefix", help="Output prefix (will produce <prefix>.original.vtt and <prefix>.en.vtt)")
-    parser.add_argument("--model", default="small", help="Whisper model (tiny, base, small, medium, large)")
-    parser.add_argument("--refine-per-segment", action="store_true",
-                        help="Re-transcribe each segment forcing detected language (improves mixed-language accuracy).")
-    parser.add_argument("--no-translate", action="store_true", help="Do not produce the English VTT (default: produce it).")
-    parser.add_argument("--keep-audio", action="store_true", help="Keep extracted audio file in current dir.")
-    parser.add_argument("--verbose", action="store_true")
-    args = parser.parse_args()
-
-    if not os.path.isfile(args.video):
-        print("Arquivo de vídeo não encontrado:", args.video)
-        return
-
-    if args.verbose:
-        print("Carregando modelo whisper:", args.model)
-    model = whisper.load_model(args.model)
-
-    with tempfile.TemporaryDirectory() as td:
+    supported = set(model.supported_languages)
+    out = {task: [""] * len(clips) for task in tasks}
+    order = sorted(range(len(clips)), key=lambda i: (ceil((clips[i][1] - clips[i][0]) / 5), clips[i][0]))
+    batches = [order[b:b + batch_size] for b in range(0, len(order), batch_size)]
+    if not batches:
+        return out
+
+    # o mel do próximo lote é calculado numa thread enquanto o lote atual roda no modelo
+    with ThreadPoolExecutor(max_workers=1) as ex, \
+         tqdm(total=len(clips), desc=f"Processando segmentos ({', '.join(tasks)})") as pbar:
+        pending = ex.submit(clip_features, model, audio, [clips[i] for i in batches[0]])
+        for n, idx in enumerate(batches):
+            batch = [clips[i] for i in idx]
+            features = pending.result()
+            if n + 1 < len(batches):
+                pending = ex.submit(clip_features, model, audio, [clips[i] for i in batches[n + 1]])
+            if verbose:
+                print(f"-> whisper lote {n + 1} ({len(batch)} segmentos, tasks={tasks})")
+            encoder_output = model.encode(features)
+
+            forced = [c[2] if c[2] in supported else None for c in batch]
+            if not model.model.is_multilingual:
+                detected = ["en"] * len(batch)
+            elif "translate" in tasks or None in forced:
+                detected = [langs[0][0][2:-2] for langs in model.model.detect_language(encoder_output)]
+            else:
+                detected = forced
+
+            for task in tasks:
+                if task == "translate":
+                    languages = detected
+                else:
+                    languages = [f or d for f, d in zip(forced, detected)]
+                texts = decode_clips(model, encoder_output, languages, task=task)
+                for i, text in zip(idx, texts):
+                    out[task][i] = text
+            pbar.update(len(batch))
+    return out
+
+def pcm_cache_key(audio, seg):
+    """Chave do cache de tradução pelo áudio: hash (hex) do PCM do trecho"""
+    sr = SAMPLE_RATE
+    pcm = audio[int(seg["start"] * sr):int(seg["end"] * sr)]
+    return "pcm:" + hashlib.blake2b(pcm.tobytes(), digest_size=16).hexdigest()
+
+def text_cache_key(seg):
+    """Chave do cache de tradução pelo texto (já refinado) normalizado, para quase-duplicatas;
+       None se o texto for vazio"""
+    norm = " ".join(seg["text"].lower().split())
+    if not norm:
+        return None
+    return "txt:" + hashlib.blake2b(f"{seg['lang']}\n{norm}".encode("utf-8"), digest_size=16).hexdigest()
+
+def load_translation_cache(path, signature):
+    """Carrega o cache de traduções de uma execução anterior.
+       Vazio se não existir, estiver inválido ou tiver sido gerado por outro modelo/compute_type."""
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    if not isinstance(data, dict) or data.get("signature") != signature:
+        return {}
+    entries = data.get("entries")
+    return entries if isinstance(entries, dict) else {}
+
+def save_translation_cache(cache, path, signature):
+    """Salva o cache de traduções (JSON) junto com o modelo que as gerou"""
+    with open(path, "wb") as f:
+        f.write(orjson.dumps({"signature": signature, "entries": cache}))
+
+def transcribe_one(model, video, out_prefix, args):
+    """
+    Processa um vídeo e grava <out_prefix>.{original,en}.{vtt,srt} e <out_prefix>.json.
+     - model: WhisperModel já carregado, ou Future de load_model (o carregamento
+       se sobrepõe à extração do áudio)
+     - args: opções da linha de comando (refine_per_segment, no_translate, ...)
+    Retorna False se o vídeo não existir.
+    """
+    if not os.path.isfile(video):
+        print("Arquivo de vídeo não encontrado:", video)
+        return False
+
+    with tempfile.TemporaryDirectory() as td, ThreadPoolExecutor(max_workers=1) as ex:
+        # o ffmpeg roda em paralelo com o carregamento do modelo (quando ainda é um Future);
+        # o áudio fica em memória (float32 16k) e os segmentos são fatias dele.
+        # Só vai para disco com --keep-audio.
         audio_file = os.path.join(td, "extracted_audio.wav")
-        if args.verbose:
-            print("Extraindo áudio para:", audio_file)
-        extract_audio(args.video, audio_file)
+        if args.keep_audio:
+            if args.verbose:
+                print("Extraindo áudio para:", audio_file)
+            extraction = ex.submit(extract_and_load_audio, video, audio_file)
+        else:
+            if args.verbose:
+                print("Extraindo áudio (pipe do ffmpeg)...")
+            extraction = ex.submit(read_audio_pcm, video)
+
+        if isinstance(model, Future):
+            model = model.result()
+        audio = extraction.result()
 
         # transcrição inicial (gera segments)
-        base_segments, overall_lang = transcribe_full_audio(model, audio_file, verbose=args.verbose)
+        base_segments, overall_lang = transcribe_full_audio(model, audio, verbose=args.verbose)
         if args.verbose:
             print(f"Segments iniciais: {len(base_segments)} — idioma global detectado: {overall_lang}")
 
+        # detect language from text (pt/es preferred), todos os segmentos de uma vez
+        texts = [seg.get("text","").strip() for seg in base_segments]
+        detections = detect_langs_of_texts([t.replace("\n", " ") for t in texts])
+
         processed = []
-        for idx, seg in enumerate(tqdm(base_segments, desc="Processando segmentos")):
+        for seg, text, detected in zip(base_segments, texts, detections):
             start = seg.get("start", 0.0)
             end = seg.get("end", start + 0.5)
-            text = seg.get("text","").strip()
-
-            # detect language from text (pt/es preferred)
-            detected = detect_lang_of_text(text) if text else ""
             chosen_lang = detected if detected else (overall_lang if overall_lang else "")
 
-            # optional refinement: re-transcribe the segment forcing the detected language
-            if args.refine_per_segment and chosen_lang in ("pt","es"):
-                if args.verbose:
-                    print(f"Refinando segmento {idx+1} ({start:.2f}-{end:.2f}) forçando idioma {chosen_lang}")
-                seg_audio = os.path.join(td, f"segment_{idx+1}.wav")
-                try:
-                    extract_audio_segment(audio_file, seg_audio, start, end)
-                    new_text = transcribe_segment_audio(model, seg_audio, language=chosen_lang, task=None, verbose=args.verbose)
-                    if new_text:
-                        text = new_text
-                except subprocess.CalledProcessError:
-                    if args.verbose:
-                        print("Falha ao extrair segmento para refinamento; mantendo texto original.")
-                finally:
-                    if os.path.exists(seg_audio):
-                        try:
-                            os.remove(seg_audio)
-                        except:
-                            pass
-
-            seg_dict = {
+            processed.append({
                 "start": start,
                 "end": end,
                 "lang": chosen_lang,
                 "text": text,
                 "translation": None
-            }
-
-            # translation: generate english text for the same time region (using whisper task='translate')
-            if not args.no_translate:
-                if args.verbose:
-                    print(f"Traduzindo segmento {idx+1} para inglês...")
-                seg_audio_t = os.path.join(td, f"segment_{idx+1}_t.wav")
-                try:
-                    extract_audio_segment(audio_file, seg_audio_t, start, end)
-                    # Use whisper task="translate" to get english text
-                    trans_text = transcribe_segment_audio(model, seg_audio_t, language=None, task="translate", verbose=args.verbose)
-                    if trans_text:
-                        seg_dict["translation"] = trans_text
-                except subprocess.CalledProcessError:
-                    if args.verbose:
-                        print("Falha ao extrair áudio para tradução; pulando tradução deste segmento.")
-                finally:
-                    if os.path.exists(seg_audio_t):
-                        try:
-                            os.remove(seg_audio_t)
-                        except:
-                            pass
-
-            processed.append(seg_dict)
-
-        # outputs VTT
-        original_vtt = f"{args.out_prefix}.original.vtt"
-        write_vtt_original(processed, original_vtt)
-        if args.verbose:
-            print("Arquivo de legendas VTT original salvo em:", original_vtt)
+            })
 
-        if not args.no_translate:
-            en_vtt = f"{args.out_prefix}.en.vtt"
-            write_vtt_translation(processed, en_vtt)
+        # VAD: segmentos quase sem fala (<10%) não passam de novo pelo whisper
+        silent = set()
+        if not args.no_vad and processed and (args.refine_per_segment or not args.no_translate):
+            ratios = speech_ratios(audio, processed)
+            silent = {i for i, r in enumerate(ratios) if r < 0.1}
             if args.verbose:
-                print("Arquivo de legendas VTT (inglês) salvo em:", en_vtt)
-
-        # outputs SRT
-        original_srt = f"{args.out_prefix}.original.srt"
-        write_srt_original(processed, original_srt)
-        if args.verbose:
-            print("Arquivo de legendas SRT original salvo em:", original_srt)
+                print(f"VAD: {len(silent)} segmentos sem fala serão pulados")
+
+        # optional refinement: re-transcribe the segments forcing the detected language.
+        # A transcrição completa já decodificou cada janela de 30 s forçando overall_lang,
+        # então só os segmentos em outro idioma precisam passar de novo pelo encoder.
+        refine = set()
+        if args.refine_per_segment:
+            candidates = {i for i, s in enumerate(processed) if s["lang"] in ("pt","es") and i not in silent}
+            refine = {i for i in candidates if processed[i]["lang"] != overall_lang}
+            if args.verbose:
+                print(f"Refinamento: {len(refine)} segmentos em outro idioma, "
+                      f"{len(candidates) - len(refine)} já no idioma global ({overall_lang}) pulados")
 
+        # translation: generate english text for the same time regions (using whisper task='translate')
+        translate = set()
         if not args.no_translate:
-            en_srt = f"{args.out_prefix}.en.srt"
-            write_srt_translation(processed, en_srt)
+            for i, seg_dict in enumerate(processed):
+                if seg_dict["lang"] == "en":
+                    # já está em inglês: reaproveita o texto, sem nova passada do whisper
+                    seg_dict["translation"] = seg_dict["text"]
+                elif i in silent:
+                    # sem fala: "" deixa o cue fora da faixa em inglês (em vez de cair no original)
+                    seg_dict["translation"] = ""
+                else:
+                    translate.add(i)
+
+        # cache de traduções: trechos repetidos (mesmo PCM ou mesmo texto) não voltam ao whisper.
+        # O texto só serve de chave quando já é o final: segmentos que ainda serão refinados
+        # usam apenas o PCM aqui e ganham a chave de texto depois do refinamento.
+        cache_path = f"{out_prefix}.trans_cache.json"
+        cache_signature = [args.model, resolve_device(args.compute_type)[1]]
+        trans_cache = load_translation_cache(cache_path, cache_signature) if translate else {}
+        to_store = []
+        first_with_key = {}
+        duplicates = {}
+        hits = 0
+        for i in sorted(translate):
+            keys = [pcm_cache_key(audio, processed[i])]
+            if i not in refine:
+                keys.append(text_cache_key(processed[i]))
+            keys = [k for k in keys if k]
+            hit = next((trans_cache[k] for k in keys if k in trans_cache), None)
+            if hit is not None:
+                processed[i]["translation"] = hit
+                translate.discard(i)
+                hits += 1
+                continue
+            first = next((first_with_key[k] for k in keys if k in first_with_key), None)
+            if first is not None:
+                duplicates[i] = first
+                translate.discard(i)
+                continue
+            to_store.append((i, keys[0]))
+            for k in keys:
+                first_with_key[k] = i
+        if args.verbose and not args.no_translate:
+            print(f"Cache de traduções: {hits} reaproveitados, {len(duplicates)} repetidos, "
+                  f"{len(to_store)} a traduzir")
+
+        # segmentos que precisam das duas coisas passam pelo encoder uma única vez
+        groups = (
+            (("transcribe", "translate"), refine & translate),
+            (("transcribe",), refine - translate),
+            (("translate",), translate - refine),
+        )
+        for tasks, indices in groups:
+            if not indices:
+                continue
+            indices = sorted(indices)
+            if args.verbose:
+                print(f"Processando {len(indices)} segmentos ({', '.join(tasks)})...")
+            clips = [(processed[i]["start"], processed[i]["end"], processed[i]["lang"]) for i in indices]
+            out = transcribe_clips(model, audio, clips, tasks=tasks,
+                                   batch_size=args.batch_size, verbose=args.verbose)
+            for i, new_text in zip(indices, out.get("transcribe", [])):
+                if new_text:
+                    processed[i]["text"] = new_text
+            for i, trans_text in zip(indices, out.get("translate", [])):
+                if trans_text:
+                    processed[i]["translation"] = trans_text
+
+        for i, first in duplicates.items():
+            processed[i]["translation"] = processed[first]["translation"]
+        if to_store:
+            for i, pcm_key in to_store:
+                trans = processed[i]["translation"]
+                if trans:
+                    trans_cache[pcm_key] = trans
+                    text_key = text_cache_key(processed[i])  # texto final, após o refinamento
+                    if text_key:
+                        trans_cache[text_key] = trans
+            save_translation_cache(trans_cache, cache_path, cache_signature)
             if args.verbose:
-                print("Arquivo de legendas SRT (inglês) salvo em:", en_srt)
+                print("Cache de traduções salvo em:", cache_path)
 
-        # json export
-        json_out = f"{args.out_prefix}.json"
-        with open(json_out, "w", encoding="utf-8") as jf:
-            json.dump(processed, jf, ensure_ascii=False, indent=2)
-        if args.verbose:
-            print("JSON com segmentos salvo em:", json_out)
+        # outputs VTT + SRT + JSON
+        for path in write_outputs(processed, out_prefix, translation=not args.no_translate):
+            if args.verbose:
+                print("Arquivo salvo em:", path)
 
         # keep audio optionally
         if args.keep_audio:
-            kept = os.path.abspath(f"{args.out_prefix}.extracted_audio.wav")
-            subprocess.run(["cp", audio_file, kept])
+            kept = os.path.abspath(f"{out_prefix}.extracted_audio.wav")
+            try:
+                # hard link é O(1) no mesmo filesystem; senão cópia feita pelo kernel
+                os.link(audio_file, kept)
+            except OSError:
+                shutil.copyfile(audio_file, kept)
             if args.verbose:
                 print("Áudio extraído salvo em:", kept)
+    return True
+
+def serve(args):
+    """
+    Modo servidor: carrega o modelo uma vez e processa um vídeo por linha da entrada padrão
+    ("video [out_prefix]"; sem prefixo usa o nome do vídeo sem extensão). Funciona com um
+    FIFO (mkfifo) para receber pedidos de outros processos. A saída padrão só recebe uma
+    resposta por pedido, "OK <prefix>" ou "ERRO <video>: <motivo>", com os caminhos citados
+    por shlex.quote (mesma sintaxe da entrada) e o motivo numa linha só; mensagens de
+    progresso (--verbose) e avisos vão para a saída de erro.
+    """
+    replies = sys.stdout
+
+    def reply(msg):
+        print(msg, file=replies, flush=True)
+
+    def reply_error(what, reason):
+        # o motivo vira uma linha só, mesmo se a mensagem de erro tiver quebras de linha
+        reply(f"ERRO {what}: {' '.join(str(reason).split())}")
+
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.verbose:
+            print("Carregando modelo whisper:", args.model)
+        model = load_model(args.model, args.compute_type)
+        print("Pronto; aguardando vídeos na entrada padrão.", flush=True)
+        for line in sys.stdin:
+            try:
+                parts = shlex.split(line)
+            except ValueError as e:
+                reply_error(shlex.quote(line.strip()), e)
+                continue
+            if not parts:
+                continue
+            video = parts[0]
+            out_prefix = parts[1] if len(parts) > 1 else os.path.splitext(video)[0]
+            if not os.path.isfile(video):
+                reply_error(shlex.quote(video), "arquivo não encontrado")
+                continue
+            try:
+                transcribe_one(model, video, out_prefix, args)
+            except Exception as e:  # um vídeo ruim não derruba o servidor
+                reply_error(shlex.quote(video), e)
+                continue
+            reply(f"OK {shlex.quote(out_prefix)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe video and produce original and English VTTs.")
+    parser.add_argument("video", nargs="?", help="Input video file (mp4, mkv, etc.)")
+    parser.add_argument("out_prefix", nargs="?", help="Output prefix (will produce <prefix>.original.vtt and <prefix>.en.vtt)")
+    parser.add_argument("--model", default="small", help="Whisper model (tiny, base, small, medium, large)")
+    parser.add_argument("--refine-per-segment", action="store_true",
+                        help="Re-transcribe segments whose detected language (pt/es) differs from the video's "
+                             "global language, forcing that language (improves mixed-language accuracy; "
+                             "no effect on single-language videos).")
+    parser.add_argument("--no-translate", action="store_true", help="Do not produce the English VTT (default: produce it).")
+    parser.add_argument("--keep-audio", action="store_true", help="Keep extracted audio file in current dir.")
+    parser.add_argument("--compute-type", default="auto",
+                        help="CTranslate2 compute type (auto, int8_float16, int8, float16, float32...).")
+    parser.add_argument("--no-vad", action="store_true",
+                        help="Do not use VAD to skip near-silent segments during refinement/translation.")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Segments per GPU batch for refinement/translation (default: 16).")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep the model loaded and process 'video [out_prefix]' lines read from stdin.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    if not args.video or not args.out_prefix:
+        parser.error("video and out_prefix are required unless --serve is used")
+    if not os.path.isfile(args.video):
+        print("Arquivo de vídeo não encontrado:", args.video)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        if args.verbose:
+            print("Carregando modelo whisper:", args.model)
+        model = ex.submit(load_model, args.model, args.compute_type)
+        transcribe_one(model, args.video, args.out_prefix, args)
 
     if args.verbose:
         print("Processamento concluído.")